@@ -1,26 +1,19 @@
-import os
-import subprocess
-import plotly.express as px
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
 import numpy as np
 import pandas as pd
 from pyproj import Transformer
-from shapely.geometry import Polygon, box,MultiPolygon
-import pyvista as pv
+from shapely.geometry import Polygon, shape
 
-from swissbuildings3d_etl import download_data, process_buildings_from_zips
 import folium
 from folium.plugins import Draw
 
 import streamlit as st
-import streamlit.components.v1 as components
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from streamlit_folium import st_folium
 
-from streamlit_3d import threed_from_file
 import utilities
 
-from pathlib import Path
-import tempfile
-
 # Set page configuration FIRST
 st.set_page_config(
     page_title="Roof Heights",
@@ -30,10 +23,18 @@ st.set_page_config(
 
 MAX_AREA=100000
 
+@st.cache_data(ttl=3600)
+def get_release_info():
+    """Returns the latest GitHub release and its date, fetched at most once an hour.
+
+    Unauthenticated GitHub API requests are limited to 60 per hour, this runs on every rerun.
+    """
+    return utilities.get_latest_release_date("https://github.com/ping13/wie-hoch-dachtraufe")
+
 # Get GitHub release info after language setup
 gh_release, gh_date = "--", "--" 
 try:
-    gh_release,gh_date=utilities.get_latest_release_date("https://github.com/ping13/wie-hoch-dachtraufe")
+    gh_release,gh_date=get_release_info()
 except:
     pass 
 
@@ -46,17 +47,22 @@ def render_content():
     # Create the map and display it
     m = create_map(center=[46.8182, 8.2275], zoom=8)
     output = st_folium(m, width=800, height=400)
-    transformer = Transformer.from_crs("EPSG:4326", "EPSG:2056", always_xy=True)
+    transformer = get_transformer()
+
+    swiss_polygon = None
+    if output["last_active_drawing"]:
+        polygon = shape(output["last_active_drawing"]["geometry"])
+
+        # Convert polygon to Swiss coordinates (one PROJ call for all vertices)
+        xs, ys = polygon.exterior.coords.xy
+        swiss_xs, swiss_ys = transformer.transform(np.asarray(xs, dtype=np.float64),
+                                                   np.asarray(ys, dtype=np.float64))
+        swiss_polygon = Polygon(np.column_stack([swiss_xs, swiss_ys]))
 
     # Render the calc button 
     if st.button("Calculate"):
-        if output["last_active_drawing"]:
-            drawn_polygon = output["last_active_drawing"]["geometry"]["coordinates"][0]
-            polygon = Polygon(drawn_polygon)
-
-            # Convert polygon to Swiss coordinates
-            swiss_coords = [transformer.transform(x, y) for x, y in polygon.exterior.coords]
-            swiss_polygon = Polygon(swiss_coords)
+        if swiss_polygon is not None:
+            lib = _lazy_imports()
 
             # Check area size
             area = swiss_polygon.area
@@ -65,22 +71,36 @@ def render_content():
                 st.stop()
                 
             print(f"Downloading {swiss_polygon}")
-            filenames_tuples = download_data(swiss_polygon, "buildings")
+            try:
+                filenames_tuples = lib.download_data(swiss_polygon, "buildings")
+            except RuntimeError as e:
+                st.error("Error downloading data from Swisstopo: " + str(e))
+                st.stop()
 
             if len(filenames_tuples) == 0:
                 st.error("No data found at Swisstopo.")
                 st.stop()
 
             print(f"Now processing {','.join(str(t) for t in filenames_tuples)}")
-            # Create a combined mesh for all buildings
-            combined_mesh = pv.PolyData()
-
-            # Create DataFrame to store building information
-            traufen = pd.DataFrame(columns=['EntityHand', 'min_height', 'max_height', 'layer','descr'])
+            # Process the tiles concurrently, the workers get the script context for
+            # the caches. The progress bar is drawn here, outside the cached function,
+            # so its updates are not recorded and replayed with the cached result
+            progress_bar = st.progress(0)
+            with ThreadPoolExecutor(max_workers=min(8, len(filenames_tuples)),
+                                    initializer=add_script_run_ctx,
+                                    initargs=(None, get_script_run_ctx())) as executor:
+                futures = [executor.submit(lib.process_buildings_from_zips, filenames[0], swiss_polygon)
+                           for filenames in filenames_tuples]
+                for idx, _ in enumerate(as_completed(futures)):
+                    progress_bar.progress((idx + 1) / len(futures),
+                                          f"Analyzed {idx + 1} of {len(futures)} data tiles")
+                results = [future.result() for future in futures]
+            progress_bar.empty()
+
+            # Collect building information, the DataFrame is built once after the loop
+            rows = []
             all_meshes = [ ]
-            for filename, filename_2d in filenames_tuples:
-                result = process_buildings_from_zips(filename, swiss_polygon)
-
+            for (filename, filename_2d), result in zip(filenames_tuples, results):
                 for layer_type, meshes in result.items():
                     for mesh in meshes:
                         all_meshes.append(mesh)
@@ -90,17 +110,24 @@ def render_content():
                         max_height = None
                         descr = "First und Höhe nicht verfügbar"
                         if z_coords.any():
-                            min_height = np.min(mesh.points[:, 2])
-                            max_height = np.max(mesh.points[:, 2])
+                            min_height, max_height = z_coords.min(), z_coords.max()
                             descr = f"<table><tr><th>Traufe</th><th>First</th></tr><tr><td>{min_height:.1f} [m]</td><td>{max_height:.1f} [m]</td></tr></table>"
                             
-                        traufen.loc[len(traufen)] = {
+                        rows.append({
                             'EntityHand': mesh.user_dict["id"],
                             'layer': mesh.user_dict["layer"],
                             'min_height': min_height,
                             'max_height': max_height,
                             'descr': descr 
-                        }
+                        })
+
+            traufen = pd.DataFrame.from_records(rows, columns=['EntityHand', 'min_height', 'max_height', 'layer','descr']).astype({
+                'EntityHand': 'string',
+                'min_height': 'float32',
+                'max_height': 'float32',
+                'layer': 'string',
+                'descr': 'string',
+            })
                         
             if len(all_meshes) == 0:
                 st.error("No buildings found, please draw a larger area.")
@@ -109,90 +136,112 @@ def render_content():
             traufen.to_csv('buildings_attributes.csv',index=False)
             
             try:
-                # First ogr2ogr command - Create shapefile
-                subprocess.run([
-                    'ogr2ogr',
-                    '-f', 'ESRI Shapefile',
-                    'output.shp.zip',
-                    filename_2d,
-                    '-sql',
-                    "SELECT * FROM entities JOIN 'buildings_attributes.csv'.buildings_attributes ON entities.EntityHand = buildings_attributes.EntityHand"
-                ], check=True)
-
-                # Second ogr2ogr command - Convert to KML
-                subprocess.run([
-                    'ogr2ogr',
-                    '-f', 'KML',
-                    'buildings.kml',
-                    'output.shp.zip',
-                    '-t_srs', 'EPSG:4326',
-                    '-s_srs', 'EPSG:2056',
-                    '-sql', 'SELECT * FROM entities WHERE min_height IS NOT NULL',
-                    '-dsco', 'NameField=EntityHand',
-                    '-dsco', 'DescriptionField=descr'
-                ], check=True)
-            except subprocess.CalledProcessError as e:
+                lib.export_kml(filename_2d, 'buildings_attributes.csv', 'buildings.kml')
+            except RuntimeError as e:
                 st.error("Error processing geographic data: " + str(e))
                 st.stop()
 
-            # Read and modify KML file
-            with open('buildings.kml', 'r') as file:
-                kml_content = file.read()
-
-            # Replace the fill tag content and add color
-            modified_kml = kml_content.replace('<fill>0</fill>', '<fill>1</fill><color>7f0000ff</color>')
-
-            # Write back the modified content
-            with open('buildings.kml', 'w') as file:
-                file.write(modified_kml)
-
-            # Create download button for KML file
+            # Read the KML file once, the styled version is only needed for the download
             with open('buildings.kml', 'rb') as file:
                 kml_bytes = file.read()
-                st.download_button(
-                    label="Download KML file",
-                    data=kml_bytes,
-                    file_name="buildings.kml",
-                    mime="application/vnd.google-earth.kml+xml"
-                )
-
-            # Show 3D object
-            output_file = "buildings.ply"            
-            # Combine all meshes
-            combined = all_meshes[0].copy()
-            for mesh in all_meshes[1:]:
-                combined = combined.merge(mesh)
-                
-            combined.save(output_file)        
-            if os.path.exists(output_file) and os.path.getsize(output_file) > 0:            
-                threed_from_file(file_path='buildings.ply',
-                                 suffix=".ply",
-                                 key='your roofs')                
-            else:
-                st.error("Failed to generate 3D model file")
-
-            # Create histogram of building heights
-            z_coords = combined.points[:, 2]  # Get all z-coordinates
-
-            fig = px.histogram(
-                z_coords, 
-                title='Distribution of z-coordinate values',
-                labels={'value': 'Point height (m)', 'count': 'Number of points'},
-                nbins=50,
-                orientation='h'  # This switches to horizontal orientation
-            )
-            fig.update_layout(
-                showlegend=False,
-                yaxis_title='Point height (m)',  # Switched from x to y
-                xaxis_title='Number of points'     # Switched from y to x
-            )
-            st.plotly_chart(fig)
+
+            # Replace the fill tag content and add color
+            kml_bytes = kml_bytes.replace(b'<fill>0</fill>', b'<fill>1</fill><color>7f0000ff</color>')
+
+            # Create the 3D object, written once straight into the 3D viewer's
+            # folder, reruns show it again
+            ply_path = lib.new_file(suffix=".ply")
+            # Combine all meshes in a single append pass, only to write the file
+            combined = lib.pv.merge(all_meshes, merge_points=False)
+            combined.save(ply_path, binary=True)
+            del combined
+
+            # Get all z-coordinates into one pre-sized buffer
+            z_all = np.empty(sum(mesh.n_points for mesh in all_meshes), dtype=np.float32)
+            offset = 0
+            for mesh in all_meshes:
+                z_all[offset:offset + mesh.n_points] = mesh.points[:, 2]
+                offset += mesh.n_points
+
+            # Remove the 3D file of the replaced result
+            previous = st.session_state.get("last_result")
+            if previous and previous['ply_path']:
+                lib.remove_saved(previous['ply_path'])
+
+            # Keep the results, so later reruns (e.g. the download click) can show
+            # them again without recalculating
+            st.session_state["last_result"] = {
+                'wkb': swiss_polygon.wkb,
+                'kml_bytes': kml_bytes,
+                'ply_path': ply_path,
+                'histogram': np.histogram(z_all, bins=50),
+            }
+
+    last_result = st.session_state.get("last_result")
+    if swiss_polygon is not None and last_result and last_result['wkb'] == swiss_polygon.wkb:
+        render_result(last_result)
 
     # Footer
     st.markdown("---")
     st.markdown(f"© 2025 [Stephan Heuel](https://blog.heuel.org/pages/contact), App Version: {gh_release}, {gh_date}")
     st.markdown("Based on [Wo sind Briefkästen](https://wieviele-briefkaesten-gibt-es.streamlit.app)")
 
+def render_result(result):
+    """Render the KML download, 3D model and height histogram of a calculation"""
+    lib = _lazy_imports()
+
+    # Create download button for KML file
+    st.download_button(
+        label="Download KML file",
+        data=result['kml_bytes'],
+        file_name="buildings.kml",
+        mime="application/vnd.google-earth.kml+xml"
+    )
+
+    # Show 3D object
+    if result['ply_path']:
+        lib.threed_from_saved(file_path=result['ply_path'],
+                              key='your roofs')
+    else:
+        st.error("Failed to generate 3D model file")
+
+    # Create histogram of building heights, binned here, so only the bin
+    # counts are sent to the browser
+    counts, edges = result['histogram']
+    centers = 0.5 * (edges[:-1] + edges[1:])
+    fig = lib.go.Figure(lib.go.Bar(
+        x=counts,
+        y=centers,
+        width=np.diff(edges),
+        orientation='h'  # This switches to horizontal orientation
+    ))
+    fig.update_layout(
+        title='Distribution of z-coordinate values',
+        bargap=0,
+        showlegend=False,
+        yaxis_title='Point height (m)',  # Switched from x to y
+        xaxis_title='Number of points'     # Switched from y to x
+    )
+    st.plotly_chart(fig)
+
+@st.cache_resource
+def _lazy_imports():
+    """Imports the heavy processing modules once, on the first calculation."""
+    import pyvista as pv
+    import plotly.graph_objects as go
+    from streamlit_3d import new_file, threed_from_saved, remove_saved
+    from swissbuildings3d_etl import download_data, export_kml, process_buildings_from_zips
+    return SimpleNamespace(
+        pv=pv,
+        go=go,
+        new_file=new_file,
+        threed_from_saved=threed_from_saved,
+        remove_saved=remove_saved,
+        download_data=download_data,
+        export_kml=export_kml,
+        process_buildings_from_zips=process_buildings_from_zips,
+    )
+
 def create_map(center, zoom):
     """Erstellt eine interaktive Karte mit Zeichentools.
 
@@ -231,6 +280,11 @@ def create_map(center, zoom):
     ).add_to(m)
     return m
 
+@st.cache_resource
+def get_transformer():
+    """Returns the WGS84 -> LV95 transformer, built once per process."""
+    return Transformer.from_crs("EPSG:4326", "EPSG:2056", always_xy=True)
+
 
 
 # Render all content
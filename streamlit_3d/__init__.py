@@ -25,14 +25,26 @@ class ThreeDComponent:
                 shutil.rmtree(self.temp_folder)
             self.temp_folder = tempfile.mkdtemp(suffix='_st_3d')
             
-            ### Copy the current component directory to the temporary folder
+            ### Hard link the current component directory into the temporary folder,
+            ### symlinks would be rejected by Streamlit as pointing outside the component
             for file in os.listdir(parent_dir):
                 src = parent_dir + os.sep + file
                 dst = self.temp_folder + os.sep + file
-                if os.path.isdir(src):
-                    shutil.copytree(src, dst)
-                else:
-                    shutil.copy(src, dst)
+                try:
+                    if os.path.isdir(src):
+                        shutil.copytree(src, dst, copy_function=os.link)
+                    else:
+                        os.link(src, dst)
+                except (OSError, NotImplementedError):
+                    ### Copy instead, e.g. if the temporary folder is on another file system
+                    if os.path.isdir(dst):
+                        shutil.rmtree(dst)
+                    elif os.path.exists(dst):
+                        os.unlink(dst)
+                    if os.path.isdir(src):
+                        shutil.copytree(src, dst)
+                    else:
+                        shutil.copy(src, dst)
 
             ### Mark setup as complete to prevent re-initialization
             self.has_setup = True  
@@ -62,31 +74,95 @@ class ThreeDComponent:
             
             ### Create a temporary file in the temporary 3d folder
             try:
-                with tempfile.NamedTemporaryFile(dir=self.temp_folder, suffix=suffix, delete=False) as temp_file:
-                    if isinstance(text, bytes):
-                        temp_file.write(text)
-                    elif isinstance(text, str):
-                        # Write the text content to the file
-                        temp_file.write(text.encode("utf-8"))  
-                    else:
-                        raise ValueError(f"Invalid text type for the 3d file")
-                    # Ensure all data is written to disk
-                    temp_file.flush()  
-                    # Store the relative path
-                    file_path = temp_file.name.split(os.sep)[-1]  
-                    # Keep track of the file for cleanup
-                    self.current_temp_files.append(temp_file.name)  
+                file_path = self.save_text(text, suffix)
 
             except Exception as e:
                 print(f"Error processing the 3d file: {e}")
                 _component_func(files_text='', height=height **kwargs)
                 return False
 
-        ### Call the 3d component with the list of file paths and their types
-        _component_func(file_path=file_path, 
+        return self.threed_from_saved(file_path, **kwargs)
+
+    def new_file(self, suffix: str):
+        """
+        Create an empty file in the temporary 3d folder, to be written by the
+        caller and shown with `threed_from_saved`.
+
+        Parameters:
+        ----------
+        suffix : str
+            The file suffix, e.g. ".ply".
+
+        Returns:
+        -------
+        str
+            The path of the new file.
+        """
+        self.setup()  # Ensure the environment is set up
+        with tempfile.NamedTemporaryFile(dir=self.temp_folder, suffix=suffix, delete=False) as temp_file:
+            # Keep track of the file for cleanup
+            self.current_temp_files.append(temp_file.name)  
+            return temp_file.name
+
+    def save_text(self,
+                  text: str,
+                  suffix: str):
+        """
+        Write a text-based ThreeD file to the temporary 3d folder, so it can be
+        shown repeatedly with `threed_from_saved` without writing it again.
+
+        Parameters:
+        ----------
+        text : str or bytes
+            The content of the ThreeD file.
+        suffix : str
+            The file suffix, e.g. ".ply".
+
+        Returns:
+        -------
+        str
+            The path of the file.
+        """
+        if isinstance(text, str):
+            # Write the text content to the file
+            text = text.encode("utf-8")
+        elif not isinstance(text, bytes):
+            raise ValueError(f"Invalid text type for the 3d file")
+        file_path = self.new_file(suffix)
+        with open(file_path, "wb") as f:
+            f.write(text)
+        return file_path
+
+    def threed_from_saved(self,
+                          file_path: str,
+                          **kwargs):
+        """
+        Create a 3D ThreeD viewer component for a file from `save_text` or `new_file`.
+
+        Parameters:
+        ----------
+        file_path : str
+            The path returned by `save_text` or `new_file`.
+        **kwargs :
+            Additional arguments passed to the Streamlit component.
+
+        Returns:
+        -------
+        bool
+            True if the component is successfully created.
+        """
+        ### Call the 3d component with the path relative to the temporary 3d folder
+        _component_func(file_path=os.path.basename(file_path) if file_path else [], 
                         **kwargs)
         return True
 
+    def remove_saved(self, file_path: str):
+        """Remove a file from `save_text` or `new_file`, e.g. when it is replaced."""
+        if file_path in self.current_temp_files:
+            self.current_temp_files.remove(file_path)
+        if os.path.exists(file_path):
+            os.unlink(file_path)
+
     def threed_from_file(self, 
                          file_path: str,
                          suffix: str,
@@ -144,6 +220,10 @@ atexit.register(threed_component.cleanup_temp_files)
 ### Declare the functions to be used in the Streamlit script
 threed_from_text = threed_component.threed_from_text
 threed_from_file = threed_component.threed_from_file
+new_file = threed_component.new_file
+save_text = threed_component.save_text
+threed_from_saved = threed_component.threed_from_saved
+remove_saved = threed_component.remove_saved
 
 # Declare the Streamlit component and link it to the temporary directory
 _component_func = components.declare_component(
@@ -1,34 +1,97 @@
-import math
 import zipfile
 import os
-import sys
+import uuid
+from contextlib import contextmanager
 from typing import Dict, Optional
+
+# Enable GDAL's thread pool and block/file caches, unless configured otherwise.
+# Set before fiona (or osgeo) loads GDAL, the ogr2ogr CLI inherits them as well
+os.environ.setdefault("GDAL_NUM_THREADS", "ALL_CPUS")
+os.environ.setdefault("GDAL_CACHEMAX", "512")  # MB
+os.environ.setdefault("VSI_CACHE", "TRUE")  # repeated reads of the zipped shapefiles
+os.environ.setdefault("VSI_CACHE_SIZE", str(100 * 1024 * 1024))  # bytes, per file
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import shapely
 from shapely import geometry
-from shapely.geometry import shape, Polygon
+from shapely.geometry import Polygon, MultiPolygon
 import numpy as np
 import fiona
 import logging
 import pyvista as pv
-import json
-import tempfile
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+try:
+    from osgeo import gdal, osr
+    gdal.UseExceptions()
+except ImportError:  # GDAL Python bindings are optional, use the ogr2ogr CLI instead
+    gdal = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Log GDAL version
-try:
-    gdal_version = subprocess.check_output(['gdalinfo', '--version'], text=True).strip()
-    logger.info(f"GDAL version: {gdal_version}")
-except subprocess.CalledProcessError as e:
-    logger.warning(f"Could not determine GDAL version: {e}")
+# Log GDAL and PROJ versions
+if gdal is not None:
+    logger.info(f"GDAL version: {gdal.__version__}, PROJ version: "
+                f"{osr.GetPROJVersionMajor()}.{osr.GetPROJVersionMinor()}.{osr.GetPROJVersionMicro()}")
+else:
+    try:
+        gdal_version = subprocess.check_output(['gdalinfo', '--version'], text=True).strip()
+        logger.info(f"GDAL version: {gdal_version}")
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning(f"Could not determine GDAL version: {e}")
 
 # Constants
 DOWNLOADS_DIR = "downloads/"
+DOWNLOAD_WORKERS = 8  # parallel tile downloads, keep it polite
+
+# One session for all requests to Swisstopo, so connections are kept alive and
+# shared by the download threads
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=16,
+    max_retries=Retry(total=5, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504]),
+))
+
+# Cache geometry arguments by their WKB, so the same drawn area hits the cache
+GEOMETRY_HASH_FUNCS = {Polygon: lambda g: g.wkb, MultiPolygon: lambda g: g.wkb}
+
+# Search endpoint and fixed query parameters of the SwissTopo API per filetype
+SWISSTOPO_SEARCH = {
+    "dem": (
+        "https://ogd.swisstopo.admin.ch/services/swiseld/services/assets/ch.swisstopo.swissalti3d/search",
+        {
+            "format": "image/tiff; application=geotiff; profile=cloud-optimized",
+            "resolution": "0.5",
+            "srid": "2056",
+            "state": "current",
+        },
+    ),
+    "buildings": (
+        "https://ogd.swisstopo.admin.ch/services/swiseld/services/assets/ch.swisstopo.swissbuildings3d_2/search",
+        {
+            "format": "application/x.dxf+zip",
+            "srid": "2056",
+            "state": "current",
+        },
+    ),
+}
+
+# Common additional headers
+SWISSTOPO_HEADERS = {
+    "User-Agent": "curl/7.84.0",
+    "Accept": "*/*",
+    "Content-Type": "application/json",
+    "Connection": "keep-alive",
+}
 
 def make_swisstopo_request(
     swiss_polygon: 'Polygon', filetype: str = "buildings"
@@ -42,54 +105,31 @@ def make_swisstopo_request(
     Returns:
         JSON response from API or None if request fails
     """
+    # Get bounds directly from the polygon, rounded so that equal areas share the cache
+    minx, miny, maxx, maxy = (round(v, 6) for v in swiss_polygon.bounds)
+    return _swisstopo_search(filetype, minx, miny, maxx, maxy)
 
-    # Get bounds directly from the polygon
-    minx, miny, maxx, maxy = swiss_polygon.bounds
-
-    if filetype == "dem":
-        url = "https://ogd.swisstopo.admin.ch/services/swiseld/services/assets/ch.swisstopo.swissalti3d/search"
-        params = {
-            "format": "image/tiff; application=geotiff; profile=cloud-optimized",
-            "resolution": "0.5",
-            "srid": "2056",
-            "state": "current",
-            "xMin": minx,
-            "xMax": maxx,
-            "yMin": miny,
-            "yMax": maxy,
-        }
-    elif filetype == "buildings":
-        url = "https://ogd.swisstopo.admin.ch/services/swiseld/services/assets/ch.swisstopo.swissbuildings3d_2/search"
-        params = {
-            "format": "application/x.dxf+zip",
-            "srid": "2056",
-            "state": "current",
-            "xMin": minx,
-            "xMax": maxx,
-            "yMin": miny,
-            "yMax": maxy,
-        }
-    else:
-        print(f"Unknown filetype {filetype}")
-        raise
+@st.cache_data(ttl="1d")
+def _swisstopo_search(filetype: str, minx: float, miny: float, maxx: float, maxy: float) -> Dict:
+    """Query the SwissTopo search API for the assets of `filetype` within the bounds.
 
-    # Common additional headers
-    headers = {
-        "User-Agent": "curl/7.84.0",
-        "Accept": "*/*",
-        "Content-Type": "application/json",
-        "Connection": "keep-alive",
-    }
+    Cached by its arguments for a day, so repeated searches skip the request
+    and new data releases (new asset URLs) are still picked up.
+    """
+    if filetype not in SWISSTOPO_SEARCH:
+        raise ValueError(f"Unknown filetype {filetype}")
+    url, params = SWISSTOPO_SEARCH[filetype]
+    params = {**params, "xMin": minx, "xMax": maxx, "yMin": miny, "yMax": maxy}
 
     try:
-        response = requests.get(url, params=params, headers=headers)
+        response = SESSION.get(url, params=params, headers=SWISSTOPO_HEADERS)
 
         response.raise_for_status()
         return response.json()
 
     except requests.exceptions.RequestException as e:
         print(f"Error making request: {e}")
-        raise 
+        raise RuntimeError(f"Error searching SwissTopo for {filetype}: {e}") from e
 
 @st.cache_data
 def download_tile(url, folder):
@@ -108,67 +148,272 @@ def download_tile(url, folder):
                 "Expires": "0",
             }
 
-            response = requests.get(url, headers=headers)
-
-            if response.status_code == 200:
-                with open(file_name, "wb") as f:
-                    f.write(response.content)
-            else:
-                print(f"Download problames with {url}")
-                sys.exit(-1)
+            # Stream to disk in chunks, tiles can be large; the partial file is
+            # only renamed once complete, so it is never mistaken for a cached tile
+            with SESSION.get(url, headers=headers, stream=True) as response:
+                if response.status_code == 200:
+                    with open(f"{file_name}.part", "wb") as f:
+                        for chunk in response.iter_content(chunk_size=1024 * 1024):
+                            f.write(chunk)
+                    os.replace(f"{file_name}.part", file_name)
+                else:
+                    raise RuntimeError(f"Download problems with {url}: HTTP {response.status_code}")
         else:
             print(f"file {file_name} already exists for {url}")
 
     except requests.exceptions.RequestException as e:
         print(f"Error downloading file: {e}")
-        sys.exit(-1)
+        raise RuntimeError(f"Error downloading {url}: {e}") from e
 
     if "dxf.zip" not in file_name:
         return file_name
     else:
         # Extract zip containing DXF
-        with zipfile.ZipFile(file_name, "r") as zip_ref:
+        try:
+            zip_ref = zipfile.ZipFile(file_name, "r")
+        except zipfile.BadZipFile as e:
+            os.remove(file_name)  # corrupt, so it is downloaded again next time
+            raise RuntimeError(f"Corrupt tile {file_name}: {e}") from e
+        with zip_ref:
             dxf_file = zip_ref.namelist()[0]  # Get first/only file
 
             # Get the expected shapefile zip name
             f_shpzip = dxf_file.replace(".dxf", ".shp.zip")
             shp_zip_path = f"{folder}/{f_shpzip}"
 
-            print(f"unzipping {file_name} and converting to a Shapefile")
-            zip_ref.extractall(folder)
-
-            print("Running ogr2ogr")
-            # Convert DXF to Shapefile
-            command = [
-                "ogr2ogr",
-                "-f",
-                "ESRI Shapefile",
-                shp_zip_path,
-                f"{folder}/{dxf_file}",
-            ]
-            subprocess.call(command)            
+            # the conversions are skipped if their output exists from an earlier run
+            if not os.path.exists(shp_zip_path):
+                print(f"unzipping {file_name} and converting to a Shapefile")
+                zip_ref.extractall(folder)
 
-            # remove dxf_file
-            os.remove(f"{folder}/{dxf_file}")
+                print("Running ogr2ogr")
+                # Convert DXF to Shapefile, with a spatial index for the bbox reads
+                with _written_atomically(shp_zip_path) as part_path:
+                    _ogr2ogr(part_path, f"{folder}/{dxf_file}",
+                             ["-f", "ESRI Shapefile", "-lco", "SPATIAL_INDEX=YES"])
 
-        # create a dissolved 2D shapefile: first create a 2D shapefile from the MultiPatch file
-        tmpshz_path = "converted_2d.shp.zip"
-        command = ["ogr2ogr", "-f", "ESRI Shapefile", tmpshz_path, shp_zip_path, "-skipfailures", "-dim", "2", "-nlt", "MULTIPOLYGON"]
-        subprocess.call(command)
-            
-        # now dissolve according to entityhand
-        f2d_shpzip = shp_zip_path.replace(".shp.zip", "_2D.shp.zip")
-        command = ["ogr2ogr", "-f", "ESRI Shapefile", f2d_shpzip, tmpshz_path, "-dialect", "sqlite", "-sql", "SELECT ST_Union(geometry) as geometry, EntityHand FROM entities GROUP BY EntityHand", "-nln", "entities"]
-        subprocess.call(command)
+                # remove dxf_file
+                os.remove(f"{folder}/{dxf_file}")
 
-        # remove temp shapefile
-        os.remove(tmpshz_path)
+        # create a 2D shapefile from the MultiPatch file, dissolved according to entityhand
+        f2d_shpzip = shp_zip_path.replace(".shp.zip", "_2D.shp.zip")
+        if not os.path.exists(f2d_shpzip):
+            with _written_atomically(f2d_shpzip) as part_path:
+                _dissolve_footprints(shp_zip_path, part_path)
 
-        
         # return zipped Shapefile
         return shp_zip_path, f2d_shpzip
 
 
+@contextmanager
+def _written_atomically(shp_zip_path):
+    """Yield a unique temporary .shp.zip path to write `shp_zip_path` to.
+
+    The file is renamed into place only if the block succeeds (and removed
+    otherwise), so a failed conversion never leaves a partial file that the
+    skip-if-exists checks would reuse.
+    """
+    part_path = shp_zip_path.replace(".shp.zip", f".{uuid.uuid4().hex}.part.shp.zip")
+    try:
+        yield part_path
+        os.replace(part_path, shp_zip_path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+
+def _dissolve_footprints(shp_zip_path, f2d_shpzip):
+    """Write the 2D footprints of all buildings in `shp_zip_path`, dissolved by EntityHand.
+
+    The faces of a building are flattened to 2D and unioned with GEOS in one
+    call per building. Faces that collapse in 2D (walls) drop out.
+
+    Args:
+        shp_zip_path: zipped 3D shapefile converted from the DXF tile
+        f2d_shpzip: zipped shapefile to write, with a layer "entities"
+    """
+    faces_by_handle: Dict[Optional[str], list] = {}
+    with fiona.open(shp_zip_path, "r") as src:
+        crs = src.crs
+        for feature in src:
+            geom = feature["geometry"]
+            if geom is None or geom["type"] not in ["Polygon", "MultiPolygon", "GeometryCollection"]:
+                continue
+            faces = shapely.get_parts(shapely.force_2d(geometry.shape(geom)))
+            faces_by_handle.setdefault(feature["properties"].get("EntityHand"), []).extend(faces)
+
+    schema = {"geometry": "MultiPolygon", "properties": {"EntityHand": "str"}}
+    with fiona.open(f2d_shpzip, "w", driver="ESRI Shapefile", crs=crs, schema=schema, layer="entities") as dst:
+        for entity_handle, faces in faces_by_handle.items():
+            footprint = shapely.union_all(shapely.make_valid(np.array(faces)))
+            polygons = [part for part in shapely.get_parts(footprint) if part.geom_type == "Polygon"]
+            if not polygons:
+                continue
+            dst.write({
+                "geometry": geometry.mapping(MultiPolygon(polygons)),
+                "properties": {"EntityHand": entity_handle},
+            })
+
+
+def _ogr2ogr(dst, src, options):
+    """Translate the vector dataset `src` to `dst` with ogr2ogr command line `options`.
+
+    Runs in-process with the GDAL Python bindings if available, otherwise with
+    the ogr2ogr command line tool.
+
+    Raises:
+        RuntimeError if GDAL fails
+    """
+    if gdal is not None:
+        # the returned dataset is not kept, so it is closed and flushed right away
+        gdal.VectorTranslate(dst, src, options=options)
+    else:
+        try:
+            subprocess.run(["ogr2ogr", *options, dst, src], check=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise RuntimeError(f"ogr2ogr failed for {src}: {e}") from e
+
+
+def export_kml(shp_2d_path, attributes_csv="buildings_attributes.csv", kml_path="buildings.kml"):
+    """Join the building attributes to the 2D footprints and write them as KML.
+
+    Runs in-process with the GDAL Python bindings if available (keeping the
+    joined shapefile in /vsimem/), otherwise with two ogr2ogr calls.
+
+    Args:
+        shp_2d_path: zipped 2D shapefile of the building footprints, LV95 coords
+        attributes_csv: CSV with an EntityHand column to join on
+        kml_path: output KML file, WGS84 coords
+
+    Raises:
+        RuntimeError if GDAL fails
+    """
+    table = os.path.splitext(os.path.basename(attributes_csv))[0]
+    join_options = [
+        "-f", "ESRI Shapefile",
+        "-sql", f"SELECT * FROM entities JOIN '{attributes_csv}'.{table} ON entities.EntityHand = {table}.EntityHand",
+    ]
+    kml_options = [
+        "-f", "KML",
+        "-t_srs", "EPSG:4326",
+        "-s_srs", "EPSG:2056",
+        "-sql", "SELECT * FROM entities WHERE min_height IS NOT NULL",
+        "-dsco", "NameField=EntityHand",
+        "-dsco", "DescriptionField=descr",
+    ]
+
+    if gdal is not None:
+        # /vsimem/ is shared by the whole process, so each export gets its own name
+        joined_path = f"/vsimem/{uuid.uuid4().hex}"
+        try:
+            joined = gdal.VectorTranslate(joined_path, shp_2d_path, options=join_options + ["-nln", "entities"])
+            # the returned KML dataset is not kept, so it is closed and flushed right away
+            gdal.VectorTranslate(kml_path, joined, options=kml_options)
+            joined = None
+        finally:
+            if gdal.VSIStatL(joined_path) is not None:
+                gdal.RmdirRecursive(joined_path)
+    else:
+        _ogr2ogr("output.shp.zip", shp_2d_path, join_options)
+        _ogr2ogr(kml_path, "output.shp.zip", kml_options)
+
+
+def _faces_from_sizes(sizes):
+    """Returns a VTK face array for consecutive polygons with `sizes` points each.
+
+    Also returns the position of each polygon's point count in the face array.
+    """
+    # exclusive cumsum, so no sizes (every face filtered out) give no positions
+    count_positions = (np.cumsum(sizes + 1) - (sizes + 1)).astype(np.int64)
+    faces = np.empty(len(sizes) + sizes.sum(), dtype=np.int64)
+    is_index = np.ones(len(faces), dtype=bool)
+    is_index[count_positions] = False
+    faces[count_positions] = sizes
+    faces[is_index] = np.arange(sizes.sum())
+    return faces, count_positions
+
+
+def _build_building_meshes(tile_points, face_building, n_buildings):
+    """Build one mesh per building from the polygon rings of a whole tile.
+
+    The face normals of all polygons are computed in one vectorized NumPy pass.
+    Vertical walls and footprint faces (horizontal faces at the lowest point of
+    their building) are dropped, then the remaining faces are split into a mesh
+    per building, with coincident points of a building merged.
+
+    Args:
+        tile_points: list of (n, 3) arrays, one exterior ring per polygon
+        face_building: index of the building of each polygon, non-decreasing
+        n_buildings: number of buildings, some may have no polygons
+
+    Returns:
+        List of n_buildings PolyData
+    """
+    if not tile_points:
+        return [pv.PolyData() for _ in range(n_buildings)]
+
+    all_points = np.vstack(tile_points)
+    assert np.all(np.abs(all_points).sum(axis=1) > 1)
+    sizes = np.array([len(points) for points in tile_points], dtype=np.int64)
+    point_offsets = np.concatenate([[0], np.cumsum(sizes[:-1])])
+
+    # Filter some faces, using the normals of all faces computed in one pass: the
+    # normal of a face is the sum of the cross products of a triangle fan around its
+    # first point (exact for planar faces, an area weighted average otherwise)
+    fan = all_points - np.repeat(all_points[point_offsets], sizes, axis=0)
+    cross = np.cross(fan, np.roll(fan, -1, axis=0))
+    cross[point_offsets + sizes - 1] = 0  # the last point has no successor in its face
+    face_normals = np.add.reduceat(cross, point_offsets, axis=0)
+    norms = np.linalg.norm(face_normals, axis=1)
+    # Get z component of normals, degenerate faces count as vertical
+    z_components = np.divide(np.abs(face_normals[:, 2]), norms, out=np.zeros(len(sizes)), where=norms > 0)
+
+    # filter vertical walls (happens sometimes)
+    vertical = z_components < 0.1  # Threshold for "vertical"
+
+    # Filter "footprint faces": horizontal faces (z component close to 1) with
+    # all points close to the minimum elevation of the building (10cm threshold)
+    min_elevation = np.full(n_buildings, np.inf)
+    np.minimum.at(min_elevation, np.repeat(face_building, sizes), all_points[:, 2])
+    near_ground = np.abs(all_points[:, 2] - np.repeat(min_elevation[face_building], sizes)) < 0.1
+    footprint = (z_components > 0.95) & np.logical_and.reduceat(near_ground, point_offsets)
+
+    keep = ~(vertical | footprint)
+
+    # Split the kept faces back into one mesh per building
+    kept_sizes = sizes[keep]
+    kept_building = face_building[keep]
+    kept_faces, count_positions = _faces_from_sizes(kept_sizes)
+
+    # Merge coincident points (shared corners, closing ring vertices) within each
+    # building, sorting by building keeps the points of a building contiguous
+    point_building = np.repeat(kept_building, kept_sizes)
+    unique_rows, inverse = np.unique(np.column_stack([point_building, all_points[np.repeat(keep, sizes)]]),
+                                     axis=0, return_inverse=True)
+    kept_points = unique_rows[:, 1:]
+
+    building_n_points = np.bincount(unique_rows[:, 0].astype(np.int64), minlength=n_buildings)
+    building_n_faces = np.bincount(kept_building, minlength=n_buildings)
+    building_face_len = np.bincount(kept_building, weights=kept_sizes + 1, minlength=n_buildings).astype(np.int64)
+    point_start = np.concatenate([[0], np.cumsum(building_n_points)])
+    face_start = np.concatenate([[0], np.cumsum(building_face_len)])
+
+    # point the faces to the merged points, with indices local to each building
+    is_index = np.ones(len(kept_faces), dtype=bool)
+    is_index[count_positions] = False
+    kept_faces[is_index] = inverse.ravel() - point_start[point_building]
+
+    meshes = []
+    for b in range(n_buildings):
+        if building_n_faces[b] == 0:
+            meshes.append(pv.PolyData())
+        else:
+            meshes.append(pv.PolyData(kept_points[point_start[b]:point_start[b + 1]],
+                                      kept_faces[face_start[b]:face_start[b + 1]]))
+    return meshes
+
+
+@st.cache_resource(hash_funcs=GEOMETRY_HASH_FUNCS, max_entries=16)
 def process_buildings_from_zips(
         input_path, mask_multi_polygons, layer_types=None, entity_handles=None
 ):
@@ -179,159 +424,130 @@ def process_buildings_from_zips(
     shp_zip = input_path
     logger.info(f"Processing {shp_zip}")
     skip_count = 0
+
+    # polygon rings of all buildings in the tile and the building index of each
+    tile_points = []
+    face_building = []
+    buildings = []
     
-    # Create progress bar
-    progress_bar = st.progress(0)
-    
-    # Get total features count using len()
-    with fiona.open(shp_zip, "r") as src:
-        total_features = len(src)
-    
-    # Process features in a separate open operation
+    # Compute the mask bounds and index the mask parts once for the bounding box
+    # tests, and prepare the mask for the containment tests
+    mask_bounds = None
+    if mask_multi_polygons:
+        # prepare a private copy, the caller's mask may be shared between threads
+        mask_multi_polygons = shapely.from_wkb(mask_multi_polygons.wkb)
+        shapely.prepare(mask_multi_polygons)
+        mask_bounds = mask_multi_polygons.bounds
+        mask_tree = shapely.STRtree(shapely.get_parts(mask_multi_polygons))
+
+    # With a mask, only read the features whose bounding box intersects the mask's
+    # one, GDAL applies the filter (with the spatial index, if there is one)
     with fiona.open(shp_zip, "r") as src:
-        for idx, feature in enumerate(src):
-            # Update progress
-            progress = (idx + 1) / total_features
-            progress_bar.progress(progress, f"Analyzing building {idx + 1} of {total_features} from the data tile")
-
-            properties = feature["properties"]
-            feature_layer_type = properties.get("Layer", "n/a")
-
-            if layer_types and all(feature_layer_type != lt for lt in layer_types):
-                continue
-            if entity_handles and all(
-                properties.get("EntityHand") != h for h in entity_handles
-            ):
-                continue
-
-            geom = feature["geometry"]
-            if geom["type"] not in [
-                "Polygon",
-                "MultiPolygon",
-                "GeometryCollection",
-            ]:
-                continue
-
-            if mask_multi_polygons:
-                geom_shape = geometry.shape(geom)
-                geom_bounds = geom_shape.bounds
-                mask_bounds = mask_multi_polygons.bounds
-
-                # Skip if geometry's bounding box is completely outside mask's bounding box
-                if (
-                    geom_bounds[2] < mask_bounds[0]
-                    or geom_bounds[0] > mask_bounds[2]  # max_x < mask_min_x
-                    or geom_bounds[3] < mask_bounds[1]  # min_x > mask_max_x
-                    or geom_bounds[1] > mask_bounds[3]  # max_y < mask_min_y
-                ):  # min_y > mask_max_y
-                    skip_count += 1
+        features = list(src.filter(bbox=mask_bounds) if mask_bounds is not None else src)
+    total_features = len(features)
+
+    # Bounding box prefilter for all features at once: first against the mask's
+    # bounding box (GDAL's filter may return more), then (in one bulk STRtree
+    # query) against the mask parts' ones
+    near_mask = np.ones(total_features, dtype=bool)
+    if mask_bounds is not None and total_features:
+        shapes = np.empty(total_features, dtype=object)
+        shapes[:] = [geometry.shape(f["geometry"]) if f["geometry"] else None for f in features]
+        minx, miny, maxx, maxy = shapely.bounds(shapes).T
+        candidates = np.flatnonzero(~(
+            (maxx < mask_bounds[0])
+            | (minx > mask_bounds[2])
+            | (maxy < mask_bounds[1])
+            | (miny > mask_bounds[3])
+        ))
+        near_mask[:] = False
+        near_mask[candidates[mask_tree.query(shapes[candidates])[0]]] = True
+
+    for idx, feature in enumerate(features):
+        properties = feature["properties"]
+        feature_layer_type = properties.get("Layer", "n/a")
+
+        if layer_types and all(feature_layer_type != lt for lt in layer_types):
+            continue
+        if entity_handles and all(
+            properties.get("EntityHand") != h for h in entity_handles
+        ):
+            continue
+
+        geom = feature["geometry"]
+        if geom["type"] not in [
+            "Polygon",
+            "MultiPolygon",
+            "GeometryCollection",
+        ]:
+            continue
+
+        # Skip if geometry's bounding box doesn't overlap the mask
+        if not near_mask[idx]:
+            skip_count += 1
+            continue
+
+        polygons = []
+        if geom["type"] == "GeometryCollection":
+            for single_geom in geom["geometries"]:
+                if single_geom["type"] == "MultiPolygon":
+                    polygons.extend(single_geom["coordinates"])
+                elif single_geom["type"] == "Polygon":
+                    polygons.append(single_geom["coordinates"])
+        elif geom["type"] == "MultiPolygon":
+            polygons = geom["coordinates"]
+        else:
+            polygons = [geom["coordinates"]]
+
+        # the exterior rings as (n, 3) arrays
+        polygon_points = [np.asarray(polygon[0], dtype=np.float64)[:, :3] for polygon in polygons]
+
+        # check if building is inside the mask, only collect valid polygons;
+        # all polygons of the building are tested in one vectorized call
+        if mask_multi_polygons is not None:
+            if polygon_points:
+                ring_index = np.repeat(np.arange(len(polygon_points)), [len(points) for points in polygon_points])
+                polys = shapely.polygons(shapely.linearrings(np.vstack(polygon_points)[:, :2], indices=ring_index))
+                valid = shapely.is_valid(polys)
+                inside = np.zeros(len(polys), dtype=bool)
+                inside[valid] = shapely.contains(mask_multi_polygons, polys[valid])
+
+                if np.any(valid & ~inside):  # found points outside
                     continue
+                polygon_points = [points for points, is_valid in zip(polygon_points, valid) if is_valid]
 
-            polygons = []
-            if geom["type"] == "GeometryCollection":
-                for single_geom in geom["geometries"]:
-                    if single_geom["type"] == "MultiPolygon":
-                        polygons.extend(single_geom["coordinates"])
-                    elif single_geom["type"] == "Polygon":
-                        polygons.append(single_geom["coordinates"])
-            elif geom["type"] == "MultiPolygon":
-                polygons = geom["coordinates"]
-            else:
-                polygons = [geom["coordinates"]]
-
-            # check if building is inside the mask, only collect valid polygons
-            if mask_multi_polygons is not None:
-                valid_polygons = []
-                found_points_outside = False
-                for p in polygons:
-                    poly = geometry.Polygon([(pt[0], pt[1]) for pt in p[0]])
-                    if poly.is_valid:
-                        if poly.within(mask_multi_polygons):
-                            valid_polygons.append(p)
-                        else:
-                            found_points_outside = True
-                polygons = valid_polygons
-
-                if not polygons:
-                    continue
-                if found_points_outside:
-                    continue
+            if not polygon_points:
+                continue
 
-            # retrieve the minimum z coordinate
-            min_elevation_feature = 9999
-            for polygon in polygons:
-                for point in polygon[0]:
-                    if point[2] < min_elevation_feature:
-                        min_elevation_feature = point[2]
-                    
-            feature_mesh = pv.PolyData()
-            for polygon in polygons:
-                
-                exterior = polygon[0]
-                n_points = len(exterior)
-
-                # Create bottom and top vertices for this polygon
-                points = []
-                for point in exterior:
-                    x, y, z = (
-                        point[0],
-                        point[1],
-                        point[2],
-                    )
-                    assert math.fabs(x) + math.fabs(y) + math.fabs(z) > 1
-                    points.append([x, y, z])  # top vertex
-
-                # Create faces for this polygon
-                faces = [ [n_points] + list(range(0, n_points)) ]
-
-                # Create a new polydata for this polygon
-                polygon_mesh = (
-                    pv.PolyData(np.array(points), np.array(faces))
-                )
-
-                # Filter some faces
-                face_normals = polygon_mesh.compute_normals(cell_normals=True).cell_normals
-                if face_normals is not None and len(face_normals) > 0:  # Check if we have any faces
-                    z_components = np.abs(face_normals[:, 2])  # Get z component of normals
-
-                    # filter vertical walls (happens sometimes)
-                    if np.all(z_components < 0.1):  # Threshold for "vertical"
-                        continue  # Skip this polygon if all faces are vertical
-
-                    # Filter "footprint faces"
-                    if np.any(z_components > 0.95):  # Check for horizontal faces (z component close to 1)
-                        # Get z coordinates of all points in the mesh
-                        z_coords = np.array(points)[:, 2]
-                        # Check if all points are close to min_elevation_feature
-                        if np.all(np.abs(z_coords - min_elevation_feature) < 0.1):  # 10cm threshold
-                            continue  # Skip this polygon if it's a horizontal face near ground level
-                        
-                if feature_mesh.n_points == 0:
-                    feature_mesh = polygon_mesh
-                else:
-                    if polygon_mesh.n_points > 0:
-                        feature_mesh = feature_mesh + polygon_mesh
-
-            # Store building properties directly in user_dict
-            building_id = feature["properties"].get("EntityHand")
-            if not building_id:
-                building_id = f"building_{building_counter}"
-                building_counter += 1
-            feature_mesh.user_dict["id"] = building_id
-            feature_mesh.user_dict["layer"] = feature["properties"].get(
-                "Layer", "unknown"
-            )
-            feature_mesh.user_dict["height"] = feature["properties"].get(
-                "Height", 0
-            )
-
-
-            # Store building mesh in our list
-            # count layer types
-            if layer_lut.get(feature_layer_type):
-                layer_lut[feature_layer_type].append(feature_mesh)
-            else:
-                layer_lut[feature_layer_type] = [ feature_mesh ]
+        # collect the rings, meshes are built for the whole tile below
+        tile_points.extend(polygon_points)
+        face_building.extend([len(buildings)] * len(polygon_points))
+
+        # Store building properties, they go into the user_dict of the building mesh
+        building_id = feature["properties"].get("EntityHand")
+        if not building_id:
+            building_id = f"building_{building_counter}"
+            building_counter += 1
+        buildings.append({
+            "id": building_id,
+            "layer": feature["properties"].get("Layer", "unknown"),
+            "height": feature["properties"].get("Height", 0),
+            "layer_type": feature_layer_type,
+        })
+
+    building_meshes = _build_building_meshes(tile_points, np.array(face_building, dtype=np.int64), len(buildings))
+
+    for building, feature_mesh in zip(buildings, building_meshes):
+        feature_mesh.user_dict["id"] = building["id"]
+        feature_mesh.user_dict["layer"] = building["layer"]
+        feature_mesh.user_dict["height"] = building["height"]
+
+        # Store building mesh in our list
+        # count layer types
+        if layer_lut.get(building["layer_type"]):
+            layer_lut[building["layer_type"]].append(feature_mesh)
+        else:
+            layer_lut[building["layer_type"]] = [ feature_mesh ]
 
     logger.info(f"Skipped buildings: {skip_count}")
     
@@ -339,11 +555,10 @@ def process_buildings_from_zips(
     for layer_type, meshes in layer_lut.items():
         logger.info(f"Layer {layer_type}: {len(meshes)} buildings")
     
-    # Clear progress bar
-    progress_bar.empty()
     
     return layer_lut
 
+@st.cache_data(hash_funcs=GEOMETRY_HASH_FUNCS, ttl="1d")
 def download_data(polygon, filetype="buildings", save_dir = DOWNLOADS_DIR):
 
     result = make_swisstopo_request(polygon, filetype=filetype)
@@ -357,11 +572,19 @@ def download_data(polygon, filetype="buildings", save_dir = DOWNLOADS_DIR):
             all_downloads_successful = True
 
         os.makedirs(f"{save_dir}/{filetype}", exist_ok=True)
+
+        # Download the tiles concurrently, the requests are latency bound
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS,
+                                initializer=add_script_run_ctx,
+                                initargs=(None, get_script_run_ctx())) as executor:
+            futures = [
+                executor.submit(download_tile, item["ass_asset_href"], f"{save_dir}{filetype}")
+                for item in result["items"]
+            ]
+
         with open(f"{save_dir}/{filetype}/files.txt", "w") as txtfile:
-            for item in result["items"]:
-                filename, filename_2d = download_tile(
-                    item["ass_asset_href"], f"{save_dir}{filetype}"
-                )
+            for future in futures:
+                filename, filename_2d = future.result()
                 if not filename:
                     all_downloads_successful = False
                 txtfile.write(f"{filename}\n")
@@ -1,4 +1,4 @@
-from bs4 import BeautifulSoup
+from urllib.parse import urlparse
 import requests
 
 def get_latest_release_date(repo_url):
@@ -9,37 +9,20 @@ def get_latest_release_date(repo_url):
     Returns:
         tuple: A tuple containing the latest release version (str) and the release date (str in ISO 8601 format).
     Raises:
-        Exception: If the releases page cannot be fetched or if no releases or release dates are found.
+        Exception: If the latest release cannot be fetched or if it has no version or release date.
     """
-    # Construct the releases page URL
-    releases_url = f"{repo_url}/releases"
+    # Construct the API URL of the latest release
+    owner, repo = urlparse(repo_url).path.strip('/').split('/')[:2]
+    api_url = f"https://api.github.com/repos/{owner}/{repo}/releases/latest"
 
-    # Send a GET request to the releases page
-    response = requests.get(releases_url)
+    # Send a GET request to the API
+    response = requests.get(api_url, headers={"Accept": "application/vnd.github+json"})
 
     if response.status_code != 200:
-        raise Exception(f"Failed to fetch the releases page: {response.status_code}")
+        raise Exception(f"Failed to fetch the latest release: {response.status_code}")
 
-    # Parse the HTML content
-    soup = BeautifulSoup(response.content, 'html.parser')
+    data = response.json()
+    if not data.get("tag_name") or not data.get("published_at"):
+        raise Exception("Could not find the release version or date of the latest release.")
 
-    # Find the latest release tag (usually it's the first `a` with the class `Link--primary` in the releases list)
-    latest_release_tag = soup.find('a', {'class': 'Link--primary'})
-
-    if not latest_release_tag:
-        raise Exception("Could not find any releases on the page.")
-
-    # Extract the release version text
-    latest_release = latest_release_tag['href'].split('/')[-1]
-
-
-    # Find the release date (usually it's in a `relative-time` tag within the release tag)
-    release_date_tag = soup.find('relative-time')
-
-    if not release_date_tag:
-        raise Exception("Could not find the release date on the page.")
-
-    # Extract the release date text
-    release_date = release_date_tag['datetime']
-
-    return latest_release, release_date
+    return data["tag_name"], data["published_at"]